@@ -11,21 +11,30 @@ This script is intentionally small and only wraps the CLI.
 from __future__ import annotations
 
 import argparse
+import functools
+import itertools
 import os
+import re
+import select
 import shlex
 import shutil
+import signal
 import subprocess
 import sys
 import time
 from pathlib import Path
 
 
+# Any line whose first non-blank character is `/`. Line starts follow
+# str.splitlines() rather than `(?m)^`, which only breaks on `\n`.
+_SLASH_RE = re.compile(r"(?:\A|(?<=[\n\r\v\f\x1c\x1d\x1e\x85\u2028\u2029]))[ \t]*/")
+
+
 def looks_like_slash_commands(prompt: str | None) -> bool:
-    if not prompt:
-        return False
-    return any(line.lstrip().startswith("/") for line in prompt.splitlines())
+    return bool(prompt) and _SLASH_RE.search(prompt) is not None
 
 
+@functools.cache
 def default_claude_bin() -> str:
     env = os.environ.get("CLAUDE_CODE_BIN")
     if env:
@@ -36,74 +45,332 @@ def default_claude_bin() -> str:
     return "/home/ubuntu/.local/bin/claude"
 
 
-def build_cmd(args: argparse.Namespace) -> list[str]:
-    cmd: list[str] = [args.claude_bin]
+@functools.cache
+def _tmux_bin() -> str | None:
+    return shutil.which("tmux")
 
-    if args.permission_mode:
-        cmd += ["--permission-mode", args.permission_mode]
 
-    if args.allowed_tools:
-        cmd += ["--allowedTools", args.allowed_tools]
+@functools.cache
+def _bin_available(path: str) -> bool:
+    return Path(path).exists() or shutil.which(path) is not None
 
-    if args.output_format:
-        cmd += ["--output-format", args.output_format]
 
-    if args.json_schema:
-        cmd += ["--json-schema", args.json_schema]
+# (flag, argparse attribute) pairs passed through as `flag value` when set.
+_OPT_MAP = (
+    ("--permission-mode", "permission_mode"),
+    ("--allowedTools", "allowed_tools"),
+    ("--output-format", "output_format"),
+    ("--json-schema", "json_schema"),
+    ("--append-system-prompt", "append_system_prompt"),
+    ("--system-prompt", "system_prompt"),
+    ("--resume", "resume"),
+)
 
-    if args.append_system_prompt:
-        cmd += ["--append-system-prompt", args.append_system_prompt]
+# The interactive TUI has no structured output.
+_INTERACTIVE_OPT_MAP = tuple(o for o in _OPT_MAP if o[1] not in {"output_format", "json_schema"})
 
-    if args.system_prompt:
-        cmd += ["--system-prompt", args.system_prompt]
 
-    if args.continue_latest:
-        cmd.append("--continue")
+def base_cmd(args: argparse.Namespace, opt_map: tuple[tuple[str, str], ...] = _OPT_MAP) -> list[str]:
+    return [
+        args.claude_bin,
+        *itertools.chain.from_iterable((flag, v) for flag, attr in opt_map if (v := getattr(args, attr))),
+        *(["--continue"] if args.continue_latest else []),
+    ]
 
-    if args.resume:
-        cmd += ["--resume", args.resume]
 
-    if args.prompt is not None:
-        cmd += ["-p", args.prompt]
-
-    if args.extra:
-        cmd += args.extra
+def build_cmd(args: argparse.Namespace) -> list[str]:
+    return [
+        *base_cmd(args),
+        *(["-p", args.prompt] if args.prompt is not None else []),
+        *(args.extra or []),
+    ]
 
-    return cmd
 
+def run_in_pty(cmd: list[str], cwd: str | None) -> int:
+    """Run `cmd` on a fresh PTY and copy its output to our stdout."""
+    import pty
 
-def run_headless(cmd: list[str], cwd: str | None) -> int:
-    if os.name == "nt":
+    pid, fd = pty.fork()
+    if pid == 0:
+        try:
+            step = "chdir"
+            if cwd:
+                os.chdir(cwd)
+            step = "exec"
+            os.execvp(cmd[0], cmd)
+        except OSError as exc:
+            print(f"{step} failed: {exc}", file=sys.stderr, flush=True)
+        finally:
+            os._exit(127)
+
+    out = sys.stdout.buffer
+    hangup = False
+    interrupted = False
+    try:
+        while True:
+            try:
+                data = os.read(fd, 65536)
+            except OSError:
+                # Linux raises EIO once the child side of the PTY is closed.
+                break
+            if not data:
+                break
+            try:
+                out.write(data)
+                out.flush()
+            except OSError:
+                # Our reader went away (e.g. `| head`). Point stdout at
+                # /dev/null so the interpreter's final flush stays quiet.
+                devnull = os.open(os.devnull, os.O_WRONLY)
+                os.dup2(devnull, out.fileno())
+                os.close(devnull)
+                hangup = True
+                break
+    except KeyboardInterrupt:
+        # The child runs in its own session, so it never saw the SIGINT.
+        hangup = interrupted = True
+    finally:
+        os.close(fd)
+        if hangup:
+            try:
+                os.kill(pid, signal.SIGHUP)
+            except ProcessLookupError:
+                pass
+        _, status = os.waitpid(pid, 0)
+
+    if interrupted:
+        return 128 + signal.SIGINT
+    code = os.waitstatus_to_exitcode(status)
+    return 128 - code if code < 0 else code
+
+
+def run_headless(cmd: list[str], cwd: str | None, output_format: str | None = None) -> int:
+    # Structured output doesn't depend on a TTY, and a real terminal already
+    # is one; only plain text piped elsewhere needs a PTY.
+    if os.name == "nt" or output_format in {"json", "stream-json"} or sys.stdout.isatty():
         return int(subprocess.run(cmd, cwd=cwd).returncode)
 
-    script_bin = shutil.which("script")
-    if not script_bin:
-        return int(subprocess.run(cmd, cwd=cwd).returncode)
+    return run_in_pty(cmd, cwd)
 
-    cmd_str = " ".join(shlex.quote(part) for part in cmd)
-    return int(subprocess.run([script_bin, "-q", "-c", cmd_str, "/dev/null"], cwd=cwd).returncode)
 
+def _tmux_arg(arg: str) -> str:
+    # tmux treats any argument ending in `;` as a command separator; `\;`
+    # keeps it literal.
+    return arg[:-1] + "\\;" if arg.endswith(";") else arg
 
-def tmux(socket_path: str, *argv: str) -> list[str]:
-    return ["tmux", "-S", socket_path, *argv]
 
+def tmux_chain(socket_path: str, *commands: tuple[str, ...]) -> list[str]:
+    """Build one tmux invocation that runs `commands` in order.
 
-def tmux_capture(socket_path: str, target: str, lines: int) -> str:
-    return subprocess.check_output(
-        tmux(socket_path, "capture-pane", "-p", "-J", "-t", target, "-S", f"-{lines}"),
-        text=True,
-    )
+    tmux stops at the first command that fails.
+    """
+    argv: list[str] = [_tmux_bin() or "tmux", "-S", socket_path]
+    for i, command in enumerate(commands):
+        if i:
+            argv.append(";")
+        argv += [_tmux_arg(a) for a in command]
+    return argv
 
 
-def tmux_wait_for(socket_path: str, target: str, needle: str, timeout_s: int) -> bool:
+def tmux(socket_path: str, *argv: str) -> list[str]:
+    return tmux_chain(socket_path, argv)
+
+
+def tmux_paste(socket_path: str, target: str, text: str, buffer: str = "clawd", submit: bool = False) -> None:
+    """Stage `text` in a tmux buffer and paste it in one go (bracketed paste)."""
+    commands = [
+        ("load-buffer", "-b", buffer, "-"),
+        ("paste-buffer", "-b", buffer, "-p", "-d", "-t", target),
+    ]
+    if submit:
+        commands.append(("send-keys", "-t", target, "Enter"))
+    subprocess.run(tmux_chain(socket_path, *commands), input=text.encode(), check=True)
+
+
+class TmuxControlClosed(OSError):
+    """The control-mode client exited, broke its pipe or stopped answering."""
+
+
+class TmuxControl:
+    """A single `tmux -C` control-mode client reused for repeated queries.
+
+    Commands are written to stdin one per line; each reply arrives on stdout
+    framed by `%begin`/`%end` (or `%error`). Anything outside a frame is an
+    asynchronous notification and is skipped. A reply that doesn't arrive
+    by its deadline closes the client, since the stream is then out of sync.
+    """
+
+    def __init__(self, socket_path: str, session: str, timeout_s: float = 5.0) -> None:
+        self.socket_path = socket_path
+        self.session = session
+        self.timeout_s = timeout_s
+        self.proc: subprocess.Popen[bytes] | None = None
+        self._buf = b""
+
+    def __enter__(self) -> TmuxControl:
+        self.proc = subprocess.Popen(
+            tmux(self.socket_path, "-C", "attach-session", "-f", "no-output", "-t", self.session),
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+        )
+        self._buf = b""
+        try:
+            self._read_reply(["attach-session"], time.time() + self.timeout_s)
+        except BaseException:
+            self.close()
+            raise
+        return self
+
+    def __exit__(self, *exc: object) -> None:
+        self.close()
+
+    def close(self) -> None:
+        proc, self.proc = self.proc, None
+        if proc is None:
+            return
+        try:
+            if proc.stdin:
+                proc.stdin.close()
+            proc.wait(timeout=2)
+        except (OSError, subprocess.TimeoutExpired):
+            proc.kill()
+            proc.wait()
+        finally:
+            if proc.stdout:
+                proc.stdout.close()
+
+    def command(self, *argv: str, deadline: float | None = None) -> str:
+        """Run one tmux command; `deadline` (a `time.time()` value) bounds the wait."""
+        if self.proc is None or self.proc.stdin is None:
+            raise TmuxControlClosed("tmux control client is not running")
+        if deadline is None:
+            deadline = time.time() + self.timeout_s
+        try:
+            self.proc.stdin.write((" ".join(shlex.quote(a) for a in argv) + "\n").encode())
+            self.proc.stdin.flush()
+        except OSError as exc:
+            raise TmuxControlClosed(f"tmux control client is gone: {exc}") from exc
+        return self._read_reply(list(argv), deadline)
+
+    def _readline(self, deadline: float) -> str | None:
+        assert self.proc is not None and self.proc.stdout is not None
+        fd = self.proc.stdout.fileno()
+        while b"\n" not in self._buf:
+            remaining = deadline - time.time()
+            if remaining <= 0 or not select.select([fd], [], [], remaining)[0]:
+                return None
+            chunk = os.read(fd, 65536)
+            if not chunk:
+                return ""
+            self._buf += chunk
+        line, _, self._buf = self._buf.partition(b"\n")
+        return line.decode(errors="replace") + "\n"
+
+    def _read_reply(self, argv: list[str], deadline: float) -> str:
+        tag = None
+        lines: list[str] = []
+        while True:
+            line = self._readline(deadline)
+            if line is None:
+                self.close()
+                raise TmuxControlClosed(f"tmux control client timed out during {argv[0]}")
+            if not line:
+                raise TmuxControlClosed(f"tmux control client exited during {argv[0]}")
+            if tag is None:
+                if line.startswith("%begin "):
+                    tag = line.split()[1:3]
+                continue
+            if line.startswith(("%end ", "%error ")) and line.split()[1:3] == tag:
+                if line.startswith("%error "):
+                    raise subprocess.CalledProcessError(1, argv, output="".join(lines))
+                return "".join(lines)
+            lines.append(line)
+
+
+def tmux_query(
+    socket_path: str,
+    *argv: str,
+    ctl: TmuxControl | None = None,
+    deadline: float | None = None,
+) -> str:
+    if ctl is not None:
+        return ctl.command(*argv, deadline=deadline)
+    return subprocess.check_output(tmux(socket_path, *argv), text=True)
+
+
+def tmux_capture(
+    socket_path: str,
+    target: str,
+    lines: int | None,
+    ctl: TmuxControl | None = None,
+    deadline: float | None = None,
+) -> str:
+    """Capture pane text; `lines=None` captures only the visible pane."""
+    argv = ["capture-pane", "-p", "-J", "-t", target]
+    if lines is not None:
+        argv += ["-S", f"-{lines}"]
+    return tmux_query(socket_path, *argv, ctl=ctl, deadline=deadline)
+
+
+def tmux_history_size(
+    socket_path: str,
+    target: str,
+    ctl: TmuxControl | None = None,
+    deadline: float | None = None,
+) -> int:
+    out = tmux_query(
+        socket_path, "display-message", "-p", "-t", target, "#{history_size}", ctl=ctl, deadline=deadline
+    )
+    return int(out.strip() or 0)
+
+
+def tmux_wait_for(
+    socket_path: str,
+    target: str,
+    needle: str,
+    timeout_s: float,
+    scrollback_every: int = 5,
+    fast_initial_probes: int = 5,
+    ctl: TmuxControl | None = None,
+) -> bool:
+    # Poll the visible pane (cheap); only pull 200 lines of scrollback every
+    # Nth probe, and only when the history has grown since the last look.
+    # Probe quickly at first, then back off exponentially while the pane is
+    # idle; any change on screen drops back to fast probing.
+    # A dead or unresponsive control client (TmuxControlClosed) is not
+    # retried here; it propagates so the caller can fall back to one-shot
+    # subprocesses.
     deadline = time.time() + timeout_s
+    last_history = 0
+    last_screen: str | None = None
+    probe = 0
+    fast_left = fast_initial_probes
+    delay = 0.05
     while time.time() < deadline:
+        probe += 1
         try:
-            if needle in tmux_capture(socket_path, target, lines=200):
+            screen = tmux_capture(socket_path, target, lines=None, ctl=ctl, deadline=deadline)
+            if needle in screen:
                 return True
-        except subprocess.CalledProcessError:
+            if screen != last_screen:
+                if last_screen is not None:
+                    fast_left = fast_initial_probes
+                    delay = 0.05
+                last_screen = screen
+            if probe % scrollback_every == 0:
+                history = tmux_history_size(socket_path, target, ctl=ctl, deadline=deadline)
+                if history != last_history:
+                    last_history = history
+                    if needle in tmux_capture(socket_path, target, lines=200, ctl=ctl, deadline=deadline):
+                        return True
+        except (subprocess.CalledProcessError, ValueError):
             pass
-        time.sleep(0.5)
+        time.sleep(min(delay, max(0.0, deadline - time.time())))
+        if fast_left > 0:
+            fast_left -= 1
+        else:
+            delay = min(delay * 1.5, 1.0)
     return False
 
 
@@ -112,10 +379,15 @@ def run_interactive(args: argparse.Namespace) -> int:
         print("interactive tmux mode is not supported on Windows", file=sys.stderr)
         return 2
 
-    if not shutil.which("tmux"):
+    if not _tmux_bin():
         print("tmux not found in PATH", file=sys.stderr)
         return 2
 
+    cwd = os.path.abspath(args.cwd or os.getcwd())
+    if not Path(cwd).is_dir():
+        print(f"working directory not found: {cwd}", file=sys.stderr)
+        return 2
+
     socket_dir = (
         args.tmux_socket_dir
         or os.environ.get("CLAWDBOT_TMUX_SOCKET_DIR")
@@ -127,41 +399,56 @@ def run_interactive(args: argparse.Namespace) -> int:
     session = args.tmux_session
     target = f"{session}:0.0"
 
-    subprocess.run(tmux(socket_path, "kill-session", "-t", session), stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-    subprocess.check_call(tmux(socket_path, "new-session", "-d", "-s", session, "-n", "shell"))
-
-    cwd = args.cwd or os.getcwd()
-
-    base: list[str] = [args.claude_bin]
-    if args.permission_mode:
-        base += ["--permission-mode", args.permission_mode]
-    if args.allowed_tools:
-        base += ["--allowedTools", args.allowed_tools]
-    if args.append_system_prompt:
-        base += ["--append-system-prompt", args.append_system_prompt]
-    if args.system_prompt:
-        base += ["--system-prompt", args.system_prompt]
-    if args.continue_latest:
-        base.append("--continue")
-    if args.resume:
-        base += ["--resume", args.resume]
-    if args.extra:
-        base += args.extra
-
-    launch = f"cd {shlex.quote(cwd)} && " + " ".join(shlex.quote(p) for p in base)
-    subprocess.check_call(tmux(socket_path, "send-keys", "-t", target, "-l", "--", launch))
-    subprocess.check_call(tmux(socket_path, "send-keys", "-t", target, "Enter"))
-
-    # Best-effort folder trust prompt acknowledgement.
-    if tmux_wait_for(socket_path, target, "trust this folder", timeout_s=20):
-        subprocess.run(tmux(socket_path, "send-keys", "-t", target, "Enter"), check=False)
+    base = [*base_cmd(args, _INTERACTIVE_OPT_MAP), *(args.extra or [])]
+
+    # Boot the pane with claude already running under an interactive login
+    # shell, so it sees the same profile/rc environment as a command typed
+    # into the pane (including PATH set after a `.bashrc` non-interactive
+    # guard, e.g. nvm). Drop back to that shell when claude exits so the
+    # session stays inspectable. The shell is passed as separate argv
+    # elements so tmux execs it directly rather than via `default-shell -c`.
+    shell = os.environ.get("SHELL") or "/bin/sh"
+    inner = " ".join(shlex.quote(p) for p in base) + f"; exec {shlex.quote(shell)} -l"
+    new_session = ("new-session", "-d", "-s", session, "-c", cwd, "-n", "shell", shell, "-lic", inner)
+    # Create optimistically; only kill a leftover session when one is in the way.
+    first = subprocess.run(tmux(socket_path, *new_session), stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    if first.returncode != 0:
+        if "duplicate session" not in first.stderr:
+            sys.stderr.write(first.stderr)
+            first.check_returncode()
+        subprocess.check_call(tmux_chain(socket_path, ("kill-session", "-t", session), new_session))
+
+    # Best-effort folder trust prompt acknowledgement, answered over the same
+    # control client that polled for it.
+    trusted = False
+    trust_deadline = time.time() + 20
+    try:
+        with TmuxControl(socket_path, session) as ctl:
+            if tmux_wait_for(socket_path, target, "trust this folder", timeout_s=20, ctl=ctl):
+                ctl.command("send-keys", "-t", target, "Enter")
+                trusted = True
+    except (OSError, subprocess.CalledProcessError):
+        remaining = trust_deadline - time.time()
+        if remaining > 0 and tmux_wait_for(socket_path, target, "trust this folder", timeout_s=remaining):
+            subprocess.run(tmux(socket_path, "send-keys", "-t", target, "Enter"), check=False)
+            trusted = True
+    if trusted:
         time.sleep(1)
 
-    if args.prompt:
-        for line in [ln for ln in args.prompt.splitlines() if ln.strip()]:
-            subprocess.check_call(tmux(socket_path, "send-keys", "-t", target, "-l", "--", line))
-            subprocess.check_call(tmux(socket_path, "send-keys", "-t", target, "Enter"))
-            time.sleep(args.interactive_send_delay_ms / 1000.0)
+    if args.prompt and args.prompt.strip():
+        if args.interactive_send_delay_ms > 0 and looks_like_slash_commands(args.prompt):
+            # Slash commands must be submitted one at a time.
+            for line in [ln for ln in args.prompt.splitlines() if ln.strip()]:
+                subprocess.check_call(
+                    tmux_chain(
+                        socket_path,
+                        ("send-keys", "-t", target, "-l", "--", line),
+                        ("send-keys", "-t", target, "Enter"),
+                    )
+                )
+                time.sleep(args.interactive_send_delay_ms / 1000.0)
+        else:
+            tmux_paste(socket_path, target, args.prompt, submit=True)
 
     print("Started interactive Claude Code in tmux")
     print(f"Monitor:  tmux -S {shlex.quote(socket_path)} attach -t {shlex.quote(session)}")
@@ -213,7 +500,7 @@ def main() -> int:
         extra = extra[1:]
     args.extra = extra
 
-    if not Path(args.claude_bin).exists() and not shutil.which(args.claude_bin):
+    if not _bin_available(args.claude_bin):
         print(f"claude binary not found: {args.claude_bin}", file=sys.stderr)
         return 2
 
@@ -224,7 +511,7 @@ def main() -> int:
     if mode == "interactive":
         return run_interactive(args)
 
-    return run_headless(build_cmd(args), cwd=args.cwd)
+    return run_headless(build_cmd(args), cwd=args.cwd, output_format=args.output_format)
 
 
 if __name__ == "__main__":